@@ -1,21 +1,31 @@
 import os
+import errno
+import fcntl
+import ipaddress
+import math
+import selectors
 import socket
+import sys
 import time
-import json
+import traceback
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 import threading
 import subprocess
 import asyncio
-import re  # for parsing socat output
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from contextlib import asynccontextmanager
-from typing import Optional
+from functools import lru_cache
+from typing import Annotated, Optional
 
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, Field
-import ipaddress
+from pydantic import AfterValidator, BaseModel, Field, IPvAnyAddress
 
 # ====================================================
 # Configuration
@@ -23,274 +33,945 @@ import ipaddress
 CONFIG_FILE = "data/servers.json"
 CHECK_INTERVAL = 5  # seconds
 
-# Define a forced rotation interval (in seconds) for round-robin mode.
-ROTATION_INTERVAL = 60  # seconds
+# Configuration changes are written at most once per this delay (in seconds),
+# so a burst of management calls results in a single write.
+CONFIG_FLUSH_DELAY = 0.25  # seconds
+
+# A failed config write is retried after a delay that doubles on every
+# consecutive failure, up to this many seconds.
+CONFIG_RETRY_MAX_DELAY = 30  # seconds
+
+# Minimum time (in seconds) a failover backend must have served before traffic
+# fails back to a preferred (earlier-listed) backend that has recovered.
+FAILBACK_DWELL = 60  # seconds
+
+# Block size (in bytes) socat uses for each read/write; larger blocks mean fewer
+# syscalls per byte relayed than socat's 8192-byte default.
+SOCAT_BUFFER_SIZE = 65536
+
+# Maximum number of bytes read from a socat output pipe at once.
+SOCAT_READ_SIZE = 65536
+
+# Maximum time (in seconds) to wait for a newly started socat to listen before
+# the one it replaces is terminated anyway.
+SOCAT_START_TIMEOUT = 2  # seconds
+
+# Maximum number of health checks running at the same time.
+PROBE_WORKERS = 32
+
+# Default minimum age (in seconds) of a health check result before the backend
+# is probed again. Services can override it with "min_check_interval".
+MIN_CHECK_INTERVAL = CHECK_INTERVAL  # seconds
+
+# Timeout (in seconds) of an HTTP health check request.
+HTTP_CHECK_TIMEOUT = 2
+
+# Default timeout (in seconds) of a TCP connect made before an HTTP health
+# check. The connect is only made when a service sets a shorter
+# "http_preprobe_timeout", to give up on unreachable backends sooner (it must
+# stay above their connect time); otherwise the HTTP request goes out directly
+# over a pooled connection.
+HTTP_PREPROBE_TIMEOUT = HTTP_CHECK_TIMEOUT
+
+# Smoothing factor of the per-backend check latency average, and the average
+# latency (in seconds) above which a healthy backend is treated as slow and
+# only used when no faster backend is available.
+LATENCY_EMA_ALPHA = 0.3
+SLOW_CHECK_LATENCY = 1.0
 
 # ====================================================
 # Global Variables for Event Loop and WebSocket Manager
 # ====================================================
 event_loop = None  # This will be set in the lifespan handler.
+stop_event = threading.Event()  # Set on shutdown to stop the background thread.
+wake_event = threading.Event()  # Set to start the next check cycle without waiting for CHECK_INTERVAL.
+
+# Guards SERVICES, its lookup indexes and service_state against concurrent
+# changes by the management endpoints and the update loop. The loop probes
+# without holding it, from the backend_index snapshot.
+state_lock = threading.RLock()
+
+# Maximum number of log messages buffered per WebSocket client; further
+# messages are dropped for that client until it catches up.
+WS_QUEUE_SIZE = 100
 
 class ConnectionManager:
+    """
+    Each connection gets its own bounded queue drained by a sender task, so
+    broadcasting never waits on a client and a slow client only holds up its
+    own messages.
+
+    All methods except broadcast_threadsafe must be called from the event loop
+    thread; that is what keeps active_connections consistent without a lock.
+    Other threads go through broadcast_threadsafe.
+    """
     def __init__(self):
-        self.active_connections = []
+        self.active_connections = {}  # websocket -> (queue, sender task)
     
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        queue = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+        task = asyncio.create_task(self._sender(websocket, queue))
+        self.active_connections[websocket] = (queue, task)
     
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        connection = self.active_connections.pop(websocket, None)
+        if connection:
+            connection[1].cancel()
     
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
+    async def _sender(self, websocket: WebSocket, queue: asyncio.Queue):
+        while True:
+            message = await queue.get()
             try:
-                await connection.send_text(message)
+                await websocket.send_text(message)
             except Exception as e:
                 print("Error sending message:", e)
+                # Stop broadcasting to a client that can no longer be reached.
+                self.active_connections.pop(websocket, None)
+                break
+    
+    def broadcast(self, *messages: str):
+        for queue, _ in list(self.active_connections.values()):
+            for message in messages:
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    break
+    
+    def broadcast_threadsafe(self, *messages: str):
+        """
+        Schedules a broadcast on the event loop from any thread. Passing several
+        messages at once hands them all over in a single wakeup of the loop.
+        """
+        if event_loop and messages:
+            event_loop.call_soon_threadsafe(self.broadcast, *messages)
 
 manager = ConnectionManager()
 
 # ====================================================
 # CONFIGURATION LOADING / SAVING
 # ====================================================
-def load_config():
+config_mtime = None  # st_mtime_ns of CONFIG_FILE when this process last read or wrote it.
+
+def load_config(force=False):
+    """
+    Reads CONFIG_FILE. Returns None if the file has not been modified since this
+    process last read or wrote it, unless force is set.
+    """
+    global config_mtime
     if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r") as f:
-            return json.load(f)
+        mtime = os.stat(CONFIG_FILE).st_mtime_ns
+        if not force and mtime == config_mtime:
+            return None
+        with open(CONFIG_FILE, "rb") as f:
+            config = orjson.loads(f.read())
+        config_mtime = mtime
+        return config
     else:
         # Default config with an empty service list.
         return {"services": [], "mode": "failover"}
 
+config_dirty = threading.Event()  # Set when SERVICES has unsaved changes.
+
+def write_config():
+    global config_mtime
+    # Writers take an exclusive lock so two processes never interleave, and the
+    # data is fsynced to a temporary file that then atomically replaces the
+    # config, so a crash never leaves a truncated file behind.
+    with state_lock:
+        data = orjson.dumps({"services": SERVICES}, option=orjson.OPT_INDENT_2)
+    tmp = CONFIG_FILE + ".tmp"
+    with open(CONFIG_FILE + ".lock", "wb") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, CONFIG_FILE)
+        config_mtime = os.stat(CONFIG_FILE).st_mtime_ns
+
 def save_config():
-    with open(CONFIG_FILE, "w") as f:
-        json.dump({"services": SERVICES}, f, indent=4)
+    """Marks the configuration as changed; config_flusher writes it shortly after."""
+    config_dirty.set()
+
+def config_flusher():
+    retry_delay = CONFIG_FLUSH_DELAY
+    while not stop_event.is_set():
+        if not config_dirty.wait(timeout=1):
+            continue
+        # Let a burst of changes accumulate before writing them out.
+        stop_event.wait(CONFIG_FLUSH_DELAY)
+        config_dirty.clear()
+        try:
+            write_config()
+        except OSError as e:
+            # Keep the changes pending and try again later rather than
+            # letting the thread die and silently stop saving.
+            print(f"Error writing {CONFIG_FILE}, retrying in {retry_delay}s:", e)
+            config_dirty.set()
+            stop_event.wait(retry_delay)
+            retry_delay = min(retry_delay * 2, CONFIG_RETRY_MAX_DELAY)
+        else:
+            retry_delay = CONFIG_FLUSH_DELAY
+
+def _config_port(value, where):
+    try:
+        port = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{where}: invalid port {value!r}") from None
+    if not 1 <= port <= 65535:
+        raise ValueError(f"{where}: port {port} is out of range 1-65535")
+    return port
+
+def canonical_ip(ip):
+    """
+    Returns ip in the form add_server stores it (e.g. "2001:db8::1" for
+    "2001:DB8::1"). Strings that are not IP addresses are returned unchanged.
+    """
+    try:
+        return str(ipaddress.ip_address(ip))
+    except ValueError:
+        return ip
+
+def _config_seconds(value, where):
+    if isinstance(value, bool):
+        raise ValueError(f"{where}: invalid number {value!r}")
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{where}: invalid number {value!r}") from None
+    if not math.isfinite(seconds):
+        raise ValueError(f"{where}: invalid number {value!r}")
+    return seconds
+
+def normalize_services(services):
+    """
+    Converts ports and per-service settings to their types in place, as the
+    config file may store them as strings, and interns service names, which are
+    compared and hashed on every lookup. Raises ValueError if a service or server
+    is missing a required field or has an invalid port or setting.
+    """
+    names = set()
+    for service in services:
+        name = service.get("name")
+        if not name:
+            raise ValueError("Config: service without a name")
+        if name in names:
+            raise ValueError(f"Config: duplicate service '{name}'")
+        names.add(name)
+        if service.get("listen_port") is None:
+            raise ValueError(f"Config: service '{name}' has no listen_port")
+        service["name"] = sys.intern(name)
+        service["listen_port"] = _config_port(service["listen_port"], f"Config: service '{name}' listen_port")
+        # Optional settings; a null value means the default.
+        for key in ("min_check_interval", "http_preprobe_timeout", "collect_stats"):
+            if key in service and service[key] is None:
+                del service[key]
+        if "min_check_interval" in service:
+            where = f"Config: service '{name}' min_check_interval"
+            service["min_check_interval"] = _config_seconds(service["min_check_interval"], where)
+            if service["min_check_interval"] < 1:
+                raise ValueError(f"{where}: must be at least 1")
+        if "http_preprobe_timeout" in service:
+            where = f"Config: service '{name}' http_preprobe_timeout"
+            service["http_preprobe_timeout"] = _config_seconds(service["http_preprobe_timeout"], where)
+            if not 0 < service["http_preprobe_timeout"] <= HTTP_CHECK_TIMEOUT:
+                raise ValueError(f"{where}: must be above 0 and at most {HTTP_CHECK_TIMEOUT}")
+        if "collect_stats" in service and not isinstance(service["collect_stats"], bool):
+            raise ValueError(f"Config: service '{name}' collect_stats: must be true or false")
+        server_keys = set()
+        for server in service.get("servers", []):
+            if not server.get("ip") or server.get("port") is None:
+                raise ValueError(f"Config: service '{name}' has a server without ip or port")
+            server["ip"] = canonical_ip(server["ip"])
+            server["port"] = _config_port(server["port"], f"Config: server {server['ip']} of service '{name}'")
+            key = (server["ip"], server["port"])
+            if key in server_keys:
+                raise ValueError(f"Config: duplicate server {server['ip']}:{server['port']} in service '{name}'")
+            server_keys.add(key)
+    return services
 
 config = load_config()
-SERVICES = config.get("services", [])
+SERVICES = normalize_services(config.get("services", []))
 # Note: Each service uses its own "mode" property.
 
+# Lookup indexes over SERVICES, kept in sync by the management endpoints:
+# service name -> service, and service name -> (ip, port) -> server.
+services_by_name = {s.get("name"): s for s in SERVICES}
+servers_by_ipport = {
+    s.get("name"): {(srv["ip"], srv["port"]): srv for srv in s.get("servers", [])}
+    for s in SERVICES
+}
+
+for service in SERVICES:
+    if service.get("mode") == "round-robin":
+        print(f"Warning: service '{service.get('name')}' uses round-robin mode. socat forwards "
+              f"port {service.get('listen_port')} to one backend at a time, so backends are only "
+              f"rotated when the current one fails; give each backend its own listen_port "
+              f"for per-connection balancing.")
+
 # ====================================================
 # HEALTH CHECK FUNCTIONS
 # ====================================================
-def is_server_alive(ip, port):
-    try:
-        with socket.create_connection((ip, port), timeout=2):
-            return True
-    except (socket.timeout, ConnectionRefusedError):
-        return False
+# Health checks run on a shared pool so that one slow backend does not delay
+# the others. Each pool thread keeps its own HTTP session (requests.Session is
+# not thread-safe) so connections to a backend are reused across cycles.
+POOL = ThreadPoolExecutor(max_workers=PROBE_WORKERS)
+_http_local = threading.local()
+
+def _http_session():
+    session = getattr(_http_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.mount("http://", HTTPAdapter(pool_connections=64, pool_maxsize=64, max_retries=0))
+        _http_local.session = session
+    return session
+
+def is_server_alive(ip, port, timeout=2):
+    # Uses the same non-blocking connect as the batched checks, so a refused
+    # connection is reported as soon as the reset arrives.
+    for _, alive in probe_tcp_batch([(ip, port)], timeout):
+        return alive
+    return False
 
-def check_http(ip, port, path="/"):
+def check_http(ip, port, path="/", preprobe_timeout=HTTP_PREPROBE_TIMEOUT):
+    # An unreachable backend fails within preprobe_timeout here instead of
+    # costing the full HTTP timeout.
+    if preprobe_timeout < HTTP_CHECK_TIMEOUT and not is_server_alive(ip, port, timeout=preprobe_timeout):
+        return False
     try:
         url = f"http://{ip}:{port}{path}"
-        response = requests.get(url, timeout=2)
-        return response.status_code == 200
+        # HEAD returns no body, so the connection goes straight back to the pool.
+        # Any answer below 500 means the server itself is up and serving.
+        response = _http_session().head(url, timeout=HTTP_CHECK_TIMEOUT, allow_redirects=False)
+        return response.status_code < 500
     except requests.RequestException:
         return False
 
 def check_smpp(ip, port=2775):
+    return is_server_alive(ip, port)
+
+@lru_cache(maxsize=1024)
+def _ip_family(ip):
+    """Returns the address family of an IP literal, or None if ip is not one."""
     try:
-        with socket.create_connection((ip, port), timeout=2):
-            return True
-    except (socket.timeout, ConnectionRefusedError):
-        return False
+        return socket.AF_INET6 if ipaddress.ip_address(ip).version == 6 else socket.AF_INET
+    except ValueError:
+        return None
+
+def probe_tcp_batch(targets, timeout=2):
+    """
+    Checks many (ip, port) targets at once: every connect is started
+    non-blocking and one selector waits for all of them. Yields
+    (target index, alive) as each connect completes; targets that have not
+    connected after timeout are reported as down.
+    """
+    sel = selectors.DefaultSelector()
+    try:
+        for n, (ip, port) in enumerate(targets):
+            try:
+                # Backends are normally IP literals, which need no resolver call;
+                # anything else (e.g. a hostname edited into the config) is resolved.
+                family = _ip_family(ip)
+                if family is None:
+                    family, _, _, _, sockaddr = socket.getaddrinfo(ip, port, type=socket.SOCK_STREAM)[0]
+                else:
+                    sockaddr = (ip, port)
+                sock = socket.socket(family, socket.SOCK_STREAM)
+            except OSError:
+                yield n, False
+                continue
+            sock.setblocking(False)
+            err = sock.connect_ex(sockaddr)
+            if err not in (0, errno.EINPROGRESS):
+                sock.close()
+                yield n, False
+                continue
+            sel.register(sock, selectors.EVENT_WRITE, n)
+
+        deadline = time.monotonic() + timeout
+        while sel.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in sel.select(remaining):
+                sock = key.fileobj
+                alive = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+                sel.unregister(sock)
+                sock.close()
+                yield key.data, alive
+
+        for key in list(sel.get_map().values()):
+            sel.unregister(key.fileobj)
+            key.fileobj.close()
+            yield key.data, False
+    finally:
+        sel.close()
+
+def _probe(ip, port, check_type, http_path, preprobe_timeout=HTTP_PREPROBE_TIMEOUT):
+    """Runs the health check configured for a single backend."""
+    if check_type == "http":
+        return check_http(ip, port, http_path, preprobe_timeout)
+    elif check_type == "smpp":
+        return check_smpp(ip, port)
+    return is_server_alive(ip, port)
 
 # ====================================================
 # GLOBALS FOR SERVICE STATE AND SOCAT STATS
 # ====================================================
 # For each service group, track:
-#  - last_active: the backend currently in use
+#  - last_active: the backend currently in use, as an (ip, port) tuple
+#  - switched_at: timestamp when last_active last changed
 #  - index: round robin index
 #  - process: the socat process
 #  - restart_count: number of times socat was restarted
 #  - last_start_time: timestamp when socat was last started
 #  - bytes_transferred, bytes_out, bytes_in: counters from socat output
-service_state = {}
-for service in SERVICES:
-    service_name = service.get("name")
-    service_state[service_name] = {
+#  - checks: last health check per backend ((ip, port) -> last_checked_ts, last_result,
+#    latency_ema)
+#  - need_check: forces every backend to be probed on the next cycle
+def new_service_state():
+    return {
         "last_active": None,
+        "switched_at": None,
         "index": 0,
         "process": None,
         "restart_count": 0,
         "last_start_time": None,
         "bytes_transferred": 0,
         "bytes_out": 0,
-        "bytes_in": 0
+        "bytes_in": 0,
+        "checks": {},
+        "need_check": True
     }
 
+service_state = {}
+for service in SERVICES:
+    service_state[service.get("name")] = new_service_state()
+
 # We also maintain a separate dictionary to track per-server stats.
-# Keys are in the format "service_name:ip:port".
+# Keys are (service_name, ip, port) tuples; /api/socat_stats_by_server turns
+# them into "service_name:ip:port" strings.
 server_stats = {}
 for service in SERVICES:
     service_name = service.get("name")
     for server in service.get("servers", []):
-        key = f"{service_name}:{server['ip']}:{server['port']}"
+        key = (service_name, server["ip"], server["port"])
         server_stats[key] = {
             "bytes_transferred": 0,
             "bytes_out": 0,
             "bytes_in": 0
         }
 
-# For display purposes, maintain a status dictionary per service.
+# For display purposes, maintain a status dictionary per service. It is
+# replaced once per check cycle, together with its encoded JSON response body.
 server_status = {}
+status_cache = orjson.dumps({"services": server_status})
+
+# Encoded response bodies of /api/socat_stats and /api/socat_stats_by_server,
+# refreshed once per check cycle rather than built on every request.
+socat_stats_cache = None
+socat_stats_by_server_cache = None
+
+def refresh_stats_cache():
+    global socat_stats_cache, socat_stats_by_server_cache
+    stats = {}
+    with state_lock:
+        for service_name, state in service_state.items():
+            stats[service_name] = {
+                "last_active": f"{state['last_active'][0]}:{state['last_active'][1]}" if state["last_active"] else None,
+                "restart_count": state["restart_count"],
+                "last_start_time": state["last_start_time"],
+                "pid": state["process"].pid if state["process"] and state["process"].poll() is None else None,
+                "bytes_transferred": state.get("bytes_transferred", 0),
+                "bytes_out": state.get("bytes_out", 0),
+                "bytes_in": state.get("bytes_in", 0)
+            }
+        stats_by_server = {
+            f"{service_name}:{ip}:{port}": counters
+            for (service_name, ip, port), counters in server_stats.items()
+        }
+        socat_stats_cache = orjson.dumps({"socat_stats": stats})
+        socat_stats_by_server_cache = orjson.dumps({"socat_stats_by_server": stats_by_server})
+
+refresh_stats_cache()
+
+# The health check loop works from a flattened copy of the backend list: one
+# array per field, with a slice per service into them. It is rebuilt whenever
+# services or servers change and replaced in a single assignment, so the loop
+# always sees a consistent snapshot.
+#   (services, slices, ips, ports, check_types, http_paths, enabled)
+backend_index = None
+
+def build_backend_index(services):
+    services = list(services)
+    slices = []
+    ips, ports, check_types, http_paths, enabled = [], array("H"), [], [], []
+    for service in services:
+        start = len(ips)
+        for server in service.get("servers", []):
+            ips.append(server["ip"])
+            ports.append(server["port"])
+            check_types.append(server.get("check_type", "tcp"))
+            http_paths.append(server.get("http_path", "/"))
+            enabled.append(server.get("enabled", True))
+        slices.append(slice(start, len(ips)))
+    return (services, slices, ips, ports, check_types, http_paths, enabled)
+
+def rebuild_backend_index():
+    global backend_index
+    backend_index = build_backend_index(SERVICES)
+
+rebuild_backend_index()
+
+def apply_config(new_config):
+    """
+    Replaces the in-memory services with those of new_config. Services that
+    still exist keep their state and socat process unless their listen port
+    changed; services that are gone have their socat process terminated.
+    Raises ValueError if new_config is invalid, in which case nothing changes.
+    """
+    global backend_index
+    # Build everything first, so an invalid config leaves the running one intact.
+    services = normalize_services(new_config.get("services", []))
+    new_by_name = {s.get("name"): s for s in services}
+    new_by_ipport = {
+        s.get("name"): {(srv["ip"], srv["port"]): srv for srv in s.get("servers", [])}
+        for s in services
+    }
+    new_index = build_backend_index(services)
+
+    old_services = dict(services_by_name)
+    SERVICES[:] = services
+    services_by_name.clear()
+    services_by_name.update(new_by_name)
+    servers_by_ipport.clear()
+    servers_by_ipport.update(new_by_ipport)
+    backend_index = new_index
+
+    for name in old_services.keys() - services_by_name.keys():
+        state = service_state.pop(name, None)
+        if state and state["process"] and state["process"].poll() is None:
+            state["process"].terminate()
+            state["process"].wait()
+
+    for service in SERVICES:
+        name = service.get("name")
+        state = service_state.get(name)
+        if state is None:
+            service_state[name] = new_service_state()
+        else:
+            state["need_check"] = True
+            if service.get("listen_port") != old_services[name].get("listen_port"):
+                if state["process"] and state["process"].poll() is None:
+                    state["process"].terminate()
+                    state["process"].wait()
+                state["last_active"] = None
+        for server in service.get("servers", []):
+            key = (name, server["ip"], server["port"])
+            if key not in server_stats:
+                server_stats[key] = {"bytes_transferred": 0, "bytes_out": 0, "bytes_in": 0}
 
 # ====================================================
 # Function to Read and Parse Socat Output for Packet/Byte Stats
 # ====================================================
-def read_socat_output(service_name, proc):
+# The output pipes of all running socat processes, drained by socat_reader.
+socat_selector = selectors.DefaultSelector()
+
+def watch_socat_output(service_name, proc):
     """
-    Reads socat's verbose output (launched with -v) from proc.stdout,
+    Hands the verbose output (launched with -v) of a socat process started for
+    service_name to socat_reader. The counters of the service and of the
+    backend it routes to are resolved once here rather than for every line.
+    """
+    ss = service_state[service_name]
+    active_server = ss["last_active"]  # (ip, port)
+    sk = None
+    if active_server:
+        sk = server_stats.setdefault((service_name, *active_server), {"bytes_transferred": 0, "bytes_out": 0, "bytes_in": 0})
+    # data: [service counters, server counters, incomplete trailing line]
+    socat_selector.register(proc.stdout, selectors.EVENT_READ, [ss, sk, b""])
+
+def socat_reader():
+    """
+    Reads the output of every running socat process through one selector,
     and updates both service-level and per-server byte counters.
-    It distinguishes outbound (lines containing "> ") and inbound (lines containing "< ").
+    Only the transfer headers socat prints before each chunk of data count, e.g.
+    "> 2024/01/01 12:00:00.000000  length=12 from=0 to=11"; their first byte
+    tells outbound (">") from inbound ("<").
+    A pipe is unregistered once its socat process exits.
     """
-    # Determine the key for the currently active server.
-    active_server = service_state[service_name]["last_active"]  # format "ip:port"
-    server_key = f"{service_name}:{active_server}" if active_server else None
-    while True:
-        line = proc.stdout.readline()
-        if not line:
-            break
-        line = line.strip()
-#        print(f"[socat-{service_name}] {line}")
-        if "length=" in line:
-            match = re.search(r"length=(\d+)", line)
-            if match:
+    while not stop_event.is_set():
+        for key, _ in socat_selector.select(timeout=0.5):
+            chunk = os.read(key.fd, SOCAT_READ_SIZE)
+            if not chunk:
+                socat_selector.unregister(key.fileobj)
+                key.fileobj.close()
+                continue
+            ss, sk, rest = key.data
+            lines = (rest + chunk).split(b"\n")
+            rest = lines.pop()
+            # A long run of output without a newline is payload, not a short
+            # length header; keep only its tail so it is not copied on every read.
+            if len(rest) > SOCAT_READ_SIZE:
+                rest = rest[-SOCAT_READ_SIZE:]
+            key.data[2] = rest
+            for line in lines:
+                direction = line[:1]
+                # Payload lines may contain "length=" too; only headers count.
+                if direction not in (b">", b"<"):
+                    continue
+                start = line.find(b"length=")
+                if start < 0:
+                    continue
+                start += 7
+                end = line.find(b" ", start)
                 try:
-                    bytes_count = int(match.group(1))
-                    # Update service-level counters.
-                    service_state[service_name]["bytes_transferred"] += bytes_count
-                    if "> " in line:
-                        service_state[service_name]["bytes_out"] += bytes_count
-                    elif "< " in line:
-                        service_state[service_name]["bytes_in"] += bytes_count
-                    # Also update per-server counters.
-                    if server_key:
-                        if server_key not in server_stats:
-                            server_stats[server_key] = {
-                                "bytes_transferred": 0,
-                                "bytes_out": 0,
-                                "bytes_in": 0
-                            }
-                        server_stats[server_key]["bytes_transferred"] += bytes_count
-                        if "> " in line:
-                            server_stats[server_key]["bytes_out"] += bytes_count
-                        elif "< " in line:
-                            server_stats[server_key]["bytes_in"] += bytes_count
+                    bytes_count = int(line[start:end] if end >= 0 else line[start:])
                 except ValueError:
-                    pass
+                    continue
+                counter = "bytes_out" if direction == b">" else "bytes_in"
+                # Update service-level counters.
+                ss["bytes_transferred"] += bytes_count
+                ss[counter] += bytes_count
+                # Also update per-server counters.
+                if sk is not None:
+                    sk["bytes_transferred"] += bytes_count
+                    sk[counter] += bytes_count
+
+# Listening sockets are looked up in /proc, so on systems without it (e.g.
+# macOS) a replaced socat is terminated without waiting for its successor.
+PROC_NET_AVAILABLE = os.path.exists("/proc/net/tcp")
+
+def _tcp_listeners(port):
+    """Returns the socket inodes listening on TCP port, read from /proc/net."""
+    inodes = set()
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as f:
+                next(f)  # header
+                for line in f:
+                    fields = line.split()
+                    # fields[1] is "address:port" in hex, fields[3] the state (0A = LISTEN).
+                    if fields[3] == "0A" and int(fields[1].rsplit(":", 1)[1], 16) == port:
+                        inodes.add(fields[9])
+        except OSError:
+            continue
+    return inodes
+
+def _socket_inodes(pid):
+    """Returns the inodes of the sockets process pid has open."""
+    inodes = set()
+    try:
+        fds = os.listdir(f"/proc/{pid}/fd")
+    except OSError:
+        return inodes
+    for fd in fds:
+        try:
+            target = os.readlink(f"/proc/{pid}/fd/{fd}")
+        except OSError:
+            continue
+        if target.startswith("socket:["):
+            inodes.add(target[8:-1])
+    return inodes
+
+def wait_for_listener(proc, port, timeout=SOCAT_START_TIMEOUT):
+    """
+    Waits until proc listens on port. Returns False if it exits or has not
+    started listening after timeout. Requires PROC_NET_AVAILABLE.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            return False
+        if _tcp_listeners(port) & _socket_inodes(proc.pid):
+            return True
+        time.sleep(0.01)
+    return False
 
 # ====================================================
 # BACKGROUND HEALTH CHECK / SOCAT UPDATE THREAD
 # ====================================================
-def update_servers():
-    global server_status, SERVICES, service_state, event_loop, server_stats
-    while True:
-        for service in SERVICES:
-            service_name = service.get("name")
-            listen_port = service.get("listen_port")
-            mode_for_service = service.get("mode", "failover")
-            healthy_servers = []
-            server_status[service_name] = {}
-            
-            for server in service.get("servers", []):
-                # Only consider servers that are enabled.
-                if not server.get("enabled", True):
-                    key = f"{server['ip']}:{server['port']} ({server.get('check_type', 'tcp')})"
-                    server_status[service_name][key] = "❌ DISABLED"
+def _record_check(state, ip, port, alive, latency):
+    """Records a check result and updates the backend's latency average."""
+    key = (ip, port)
+    previous = state["checks"].get(key)
+    latency_ema = previous["latency_ema"] if previous else None
+    if alive:
+        if latency_ema is None:
+            latency_ema = latency
+        else:
+            latency_ema = LATENCY_EMA_ALPHA * latency + (1 - LATENCY_EMA_ALPHA) * latency_ema
+    state["checks"][key] = {
+        "last_checked_ts": time.time(),
+        "last_result": alive,
+        "latency_ema": latency_ema
+    }
+
+def _run_check(state, ip, port, check_type, http_path, preprobe_timeout):
+    """Probes a backend and records the result and latency on its service state."""
+    start = time.monotonic()
+    alive = _probe(ip, port, check_type, http_path, preprobe_timeout)
+    _record_check(state, ip, port, alive, time.monotonic() - start)
+    return alive
+
+def _run_tcp_checks(batch):
+    """Runs a list of (state, ip, port, future) TCP checks with a single selector."""
+    start = time.monotonic()
+    try:
+        for n, alive in probe_tcp_batch([(ip, port) for _, ip, port, _ in batch]):
+            state, ip, port, future = batch[n]
+            _record_check(state, ip, port, alive, time.monotonic() - start)
+            future.set_result(alive)
+    finally:
+        # Never leave the update loop waiting on a check that did not report.
+        for _, _, _, future in batch:
+            if not future.done():
+                future.set_result(False)
+
+def _schedule_check(service, ip, port, check_type, http_path, now, tcp_batch):
+    """
+    Returns a future resolving to the backend's health. A result younger than
+    the service's min_check_interval is reused instead of probing again, unless
+    the service has been flagged with need_check. Plain TCP checks (tcp, smpp)
+    are appended to tcp_batch to be run together; HTTP checks go to the pool.
+    """
+    state = service_state[service.get("name")]
+    check = state["checks"].get((ip, port))
+    min_interval = service.get("min_check_interval", MIN_CHECK_INTERVAL)
+    if check and not state["need_check"] and now - check["last_checked_ts"] < min_interval:
+        future = Future()
+        future.set_result(check["last_result"])
+        return future
+    if check_type != "http":
+        future = Future()
+        tcp_batch.append((state, ip, port, future))
+        return future
+    preprobe_timeout = service.get("http_preprobe_timeout", HTTP_PREPROBE_TIMEOUT)
+    return POOL.submit(_run_check, state, ip, port, check_type, http_path, preprobe_timeout)
+
+def run_update_cycle():
+    """Probes the backends once and (re)starts socat where the routing changed."""
+    global server_status, status_cache
+    services, slices, ips, ports, check_types, http_paths, enabled = backend_index
+    now = time.time()
+    # Probe every enabled backend of every service concurrently; a cycle now
+    # takes as long as the slowest check instead of the sum of all of them.
+    futures = [None] * len(ips)
+    pending = {}
+    tcp_batch = []
+    with state_lock:
+        for service, sl in zip(services, slices):
+            # Skip a service removed since the snapshot was taken.
+            if services_by_name.get(service.get("name")) is not service:
+                continue
+            # If socat exited on its own, re-check every backend of the service.
+            proc = service_state[service.get("name")]["process"]
+            if proc is not None and proc.poll() is not None:
+                service_state[service.get("name")]["need_check"] = True
+            for i in range(sl.start, sl.stop):
+                if enabled[i]:
+                    futures[i] = _schedule_check(service, ips[i], ports[i], check_types[i],
+                                                 http_paths[i], now, tcp_batch)
+                    pending[futures[i]] = (service.get("name"), i)
+    if tcp_batch:
+        POOL.submit(_run_tcp_checks, tcp_batch)
+
+    # Report a backend going up or down as soon as its probe finishes,
+    # rather than once the slowest probe of the cycle is done.
+    for future in as_completed(pending):
+        service_name, i = pending[future]
+        key = f"{ips[i]}:{ports[i]} ({check_types[i]})"
+        previous = server_status.get(service_name, {}).get(key)
+        alive = future.result()
+        if previous and previous != "❌ DISABLED" and ("UP" in previous) != alive:
+            manager.broadcast_threadsafe(
+                f"Backend {ips[i]}:{ports[i]} of service '{service_name}' is now {'UP' if alive else 'DOWN'}"
+            )
+
+    status = {}
+    # Routing messages of this cycle, broadcast together once it is done.
+    log_messages = []
+    # (service name, new socat, socat it replaces, listen port), handed over
+    # once state_lock is released.
+    handoffs = []
+    try:
+        for service, sl in zip(services, slices):
+            with state_lock:
+                if services_by_name.get(service.get("name")) is not service:
                     continue
+                service_name = service.get("name")
+                listen_port = service.get("listen_port")
+                mode_for_service = service.get("mode", "failover")
+                healthy_servers = []
+                slow_servers = []
+                status[service_name] = {}
+                service_state[service_name]["need_check"] = False
+        
+                for i in range(sl.start, sl.stop):
+                    ip = ips[i]
+                    port = ports[i]
+                    key = f"{ip}:{port} ({check_types[i]})"
+                    # Only consider servers that are enabled.
+                    if futures[i] is None:
+                        status[service_name][key] = "❌ DISABLED"
+                        continue
 
-                ip = server["ip"]
-                port = int(server["port"])
-                check_type = server.get("check_type", "tcp")
-                
-                if check_type == "http":
-                    alive = check_http(ip, port, server.get("http_path", "/"))
-                elif check_type == "smpp":
-                    alive = check_smpp(ip, port)
-                else:
-                    alive = is_server_alive(ip, port)
-                
-                key = f"{ip}:{port} ({check_type})"
-                server_status[service_name][key] = "🟢 UP" if alive else "🔴 DOWN"
-                if alive:
-                    healthy_servers.append(f"{ip}:{port}")
-            
-            if healthy_servers:
-                # --- Round Robin Mode Handling ---
-                if mode_for_service == "round-robin":
-                    # Force rotation: restart socat even if a process is running after a fixed interval.
-                    current_proc = service_state[service_name]["process"]
-                    now = time.time()
-                    last_start = service_state[service_name].get("last_start_time") or 0
-                    if current_proc is not None and current_proc.poll() is None:
-                        # If less than ROTATION_INTERVAL has passed, do nothing.
-                        if now - last_start < ROTATION_INTERVAL:
-                            continue
-                    idx = service_state[service_name]["index"]
-                    selected_server = healthy_servers[idx % len(healthy_servers)]
-                    service_state[service_name]["index"] = idx + 1
-                else:  # Failover Mode
-                    selected_server = healthy_servers[0]
-                    if selected_server == service_state[service_name]["last_active"]:
+                    if not futures[i].result():
+                        status[service_name][key] = "🔴 DOWN"
+                        continue
+                    check = service_state[service_name]["checks"].get((ip, port))
+                    if check and (check["latency_ema"] or 0) > SLOW_CHECK_LATENCY:
+                        status[service_name][key] = "🟡 UP (slow)"
+                        slow_servers.append((ip, port))
+                    else:
+                        status[service_name][key] = "🟢 UP"
+                        healthy_servers.append((ip, port))
+                # Slow backends are demoted behind the responsive ones.
+                healthy_servers.extend(slow_servers)
+        
+                if healthy_servers:
+                    current = service_state[service_name]["last_active"]
+                    # --- Round Robin Mode Handling ---
+                    if mode_for_service == "round-robin":
+                        # socat sends every connection on the listen port to a single
+                        # backend, so rotating on a timer would only restart socat and
+                        # drop connections. Stay on the current backend while it is
+                        # healthy and move on to the next one in turn when it fails.
+                        if current in healthy_servers:
+                            selected_server = current
+                        else:
+                            idx = service_state[service_name]["index"]
+                            selected_server = healthy_servers[idx % len(healthy_servers)]
+                            service_state[service_name]["index"] = idx + 1
+                    else:  # Failover Mode
+                        # Stick to the current backend while it is healthy, and only
+                        # fail back to a preferred one after FAILBACK_DWELL, so a
+                        # flapping backend does not restart socat every cycle.
+                        selected_server = healthy_servers[0]
+                        if selected_server != current and current in healthy_servers:
+                            switched_at = service_state[service_name]["switched_at"] or 0
+                            if time.time() - switched_at < FAILBACK_DWELL:
+                                selected_server = current
+                    if selected_server == current:
                         current_proc = service_state[service_name]["process"]
                         if current_proc is not None and current_proc.poll() is None:
                             continue
 
-                log_message = (f"Routing traffic on port {listen_port} to {selected_server} "
-                               f"for service '{service_name}' (mode: {mode_for_service})")
-                print(log_message)
-                if event_loop:
-                    asyncio.run_coroutine_threadsafe(manager.broadcast(log_message), event_loop)
-                
-                service_state[service_name]["restart_count"] += 1
-                service_state[service_name]["last_start_time"] = time.time()
-                
-                # Terminate previous process if still running.
-                prev_proc = service_state[service_name]["process"]
-                if prev_proc and prev_proc.poll() is None:
-                    prev_proc.terminate()
-                    prev_proc.wait()
-                
-                # Start socat in verbose mode (-v) to capture stats.
-                cmd = [
-                    "socat",
-                    "-v",
-                    f"TCP-LISTEN:{listen_port},fork,reuseaddr",
-                    f"TCP:{selected_server}"
-                ]
-                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-                service_state[service_name]["process"] = proc
-                service_state[service_name]["last_active"] = selected_server
-                
-                # Initialize per-server stats for this backend if not already done.
-                server_key = f"{service_name}:{selected_server}"
-                if server_key not in server_stats:
-                    server_stats[server_key] = {
-                        "bytes_transferred": 0,
-                        "bytes_out": 0,
-                        "bytes_in": 0
-                    }
-                
-                # Start a thread to parse socat output.
-                threading.Thread(target=read_socat_output, args=(service_name, proc), daemon=True).start()
-            else:
-                log_message = f"No healthy servers available on port {listen_port} for service '{service_name}'"
-                print(log_message)
-                if event_loop:
-                    asyncio.run_coroutine_threadsafe(manager.broadcast(log_message), event_loop)
-                current_proc = service_state[service_name]["process"]
-                if current_proc and current_proc.poll() is None:
-                    current_proc.terminate()
-                    current_proc.wait()
-                service_state[service_name]["last_active"] = None
-        
-        time.sleep(CHECK_INTERVAL)
+                    target = f"{selected_server[0]}:{selected_server[1]}"
+                    log_message = (f"Routing traffic on port {listen_port} to {target} "
+                                   f"for service '{service_name}' (mode: {mode_for_service})")
+                    print(log_message)
+                    log_messages.append(log_message)
+            
+                    service_state[service_name]["restart_count"] += 1
+                    service_state[service_name]["last_start_time"] = time.time()
+            
+                    # Start socat in verbose mode (-v) to capture stats, unless the
+                    # service opted out with "collect_stats": false; -v makes socat
+                    # dump every byte it relays. The listener uses reuseport so the
+                    # new socat can bind while the previous one is still accepting.
+                    prev_proc = service_state[service_name]["process"]
+                    if PROC_NET_AVAILABLE and (prev_proc is None or prev_proc.poll() is not None):
+                        # reuseport would also let a stray socat, e.g. left over from
+                        # a crashed run, silently share the port.
+                        if _tcp_listeners(listen_port):
+                            log_message = (f"Warning: port {listen_port} of service '{service_name}' "
+                                           f"is already in use by another process")
+                            print(log_message)
+                            log_messages.append(log_message)
+                    collect_stats = service.get("collect_stats", True)
+                    cmd = [
+                        "socat",
+                        *(["-v"] if collect_stats else []),
+                        "-b", str(SOCAT_BUFFER_SIZE),
+                        f"TCP-LISTEN:{listen_port},fork,reuseaddr,reuseport",
+                        f"TCP:{target}"
+                    ]
+                    if collect_stats:
+                        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                    else:
+                        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+                    service_state[service_name]["process"] = proc
+                    if selected_server != service_state[service_name]["last_active"]:
+                        service_state[service_name]["switched_at"] = time.time()
+                    service_state[service_name]["last_active"] = selected_server
+            
+                    if prev_proc and prev_proc.poll() is None:
+                        handoffs.append((service_name, proc, prev_proc, listen_port))
+            
+                    # Initialize per-server stats for this backend if not already done.
+                    server_key = (service_name, *selected_server)
+                    if server_key not in server_stats:
+                        server_stats[server_key] = {
+                            "bytes_transferred": 0,
+                            "bytes_out": 0,
+                            "bytes_in": 0
+                        }
+            
+                    # Let the reader thread parse socat output.
+                    if collect_stats:
+                        watch_socat_output(service_name, proc)
+                else:
+                    log_message = f"No healthy servers available on port {listen_port} for service '{service_name}'"
+                    print(log_message)
+                    log_messages.append(log_message)
+                    current_proc = service_state[service_name]["process"]
+                    if current_proc and current_proc.poll() is None:
+                        current_proc.terminate()
+                        current_proc.wait()
+                    service_state[service_name]["last_active"] = None
+    finally:
+        # Terminate each replaced socat once its successor accepts connections, so
+        # the port is not left without a listener. This may take a moment, so it is
+        # done without holding state_lock.
+        for service_name, proc, prev_proc, listen_port in handoffs:
+            if PROC_NET_AVAILABLE and not wait_for_listener(proc, listen_port):
+                print(f"socat for service '{service_name}' is not listening on "
+                      f"port {listen_port} after {SOCAT_START_TIMEOUT}s")
+            prev_proc.terminate()
+            prev_proc.wait()
+
+    manager.broadcast_threadsafe(*log_messages)
+    server_status = status
+    status_cache = orjson.dumps({"services": status})
+    refresh_stats_cache()
+
+def update_servers():
+    while not stop_event.is_set():
+        # Cleared before the cycle starts, so a change made while it runs still
+        # triggers another one right after.
+        wake_event.clear()
+        try:
+            run_update_cycle()
+        except Exception:
+            # One bad value must not stop health checking for good.
+            print("Error in health check cycle:")
+            traceback.print_exc()
+        wake_event.wait(CHECK_INTERVAL)
 
-def start_background_thread():
-    thread = threading.Thread(target=update_servers, daemon=True)
+def start_background_thread(target=update_servers):
+    thread = threading.Thread(target=target, daemon=True)
     thread.start()
+    return thread
+
+def stop_background_threads(*threads):
+    """
+    Stops the background threads, terminates the socat processes they started
+    and writes out any configuration change that has not been flushed yet.
+    """
+    stop_event.set()
+    wake_event.set()
+    for thread in threads:
+        thread.join()
+    for state in list(service_state.values()):
+        proc = state["process"]
+        if proc and proc.poll() is None:
+            proc.terminate()
+            proc.wait()
+    if config_dirty.is_set():
+        config_dirty.clear()
+        write_config()
 
 # ====================================================
 # Lifespan Event Handler (Startup/Shutdown)
@@ -299,8 +980,15 @@ def start_background_thread():
 async def lifespan(app: FastAPI):
     global event_loop
     event_loop = asyncio.get_running_loop()
-    start_background_thread()
+    # The UI page does not change while running; read it once.
+    with open("public/index.html", "rb") as f:
+        app.state.index_bytes = f.read()
+    app.state.updater = start_background_thread()
+    app.state.flusher = start_background_thread(config_flusher)
+    app.state.socat_reader = start_background_thread(socat_reader)
     yield
+    await asyncio.to_thread(stop_background_threads, app.state.updater, app.state.flusher,
+                            app.state.socat_reader)
 
 app = FastAPI(lifespan=lifespan)
 
@@ -316,6 +1004,17 @@ app.add_middleware(
 )
 app.mount("/assets", StaticFiles(directory="public/assets"), name="assets")
 
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request: Request, exc: RequestValidationError):
+    # Report invalid input as a single message, like the HTTPException details
+    # the UI displays, e.g. "port: Input should be less than or equal to 65535".
+    messages = []
+    for error in exc.errors():
+        # loc starts with where the value came from ("body", "query", ...).
+        field = ".".join(str(part) for part in error["loc"][1:] if isinstance(part, str))
+        messages.append(f"{field}: {error['msg']}" if field else error["msg"])
+    return JSONResponse(status_code=422, content={"detail": "; ".join(messages)})
+
 # ====================================================
 # WebSocket Endpoint for Real‑Time Logs
 # ====================================================
@@ -324,31 +1023,41 @@ async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
     try:
         while True:
-            await websocket.receive_text()
+            message = await websocket.receive_text()
+            if message == "force_check":
+                # Probe every backend on the next cycle regardless of min_check_interval.
+                for state in list(service_state.values()):
+                    state["need_check"] = True
+                wake_event.set()
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
 # ====================================================
 # Pydantic Models for Request Bodies
 # ====================================================
+# The address of an existing server, matched against the stored form.
+ServerIP = Annotated[str, AfterValidator(canonical_ip)]
+
 class EditServerRequest(BaseModel):
     service: str
-    ip: str
+    ip: ServerIP
     port: int
-    new_ip: Optional[str] = None
-    new_port: Optional[int] = None
-    check_type: Optional[str] = None
+    new_ip: Optional[IPvAnyAddress] = None
+    new_port: Optional[int] = Field(None, ge=1, le=65535)
+    check_type: Optional[str] = Field(None, pattern="^(tcp|http|smpp)$", description="Check type must be 'tcp', 'http' or 'smpp'")
 
 class AddServerRequest(BaseModel):
     service: str
-    ip: str
-    port: int
-    check_type: str = "tcp"
+    ip: IPvAnyAddress
+    port: int = Field(..., ge=1, le=65535)
+    check_type: str = Field("tcp", pattern="^(tcp|http|smpp)$", description="Check type must be 'tcp', 'http' or 'smpp'")
     http_path: str = "/"
 
 class RemoveServerRequest(BaseModel):
     service: str
-    ip: str
+    ip: ServerIP
     port: int
 
 class SetServiceModeRequest(BaseModel):
@@ -356,22 +1065,28 @@ class SetServiceModeRequest(BaseModel):
     mode: str = Field(..., pattern="^(failover|round-robin)$", description="Mode must be either 'failover' or 'round-robin'")
 
 class AddServiceRequest(BaseModel):
-    name: str
-    listen_port: int
-    mode: Optional[str] = "failover"
+    name: str = Field(..., min_length=1)
+    listen_port: int = Field(..., ge=1, le=65535)
+    mode: Optional[str] = Field("failover", pattern="^(failover|round-robin)$", description="Mode must be either 'failover' or 'round-robin'")
+    min_check_interval: Optional[float] = Field(None, ge=1, description="Minimum seconds between health checks of a backend")
+    http_preprobe_timeout: Optional[float] = Field(None, gt=0, le=HTTP_CHECK_TIMEOUT, description="Seconds to wait for the TCP connect before an HTTP health check")
+    collect_stats: Optional[bool] = Field(None, description="Run socat with -v to collect byte counters")
 
 class EditServiceRequest(BaseModel):
     name: str
     new_name: Optional[str] = None
-    listen_port: Optional[int] = None
-    mode: Optional[str] = None
+    listen_port: Optional[int] = Field(None, ge=1, le=65535)
+    mode: Optional[str] = Field(None, pattern="^(failover|round-robin)$", description="Mode must be either 'failover' or 'round-robin'")
+    min_check_interval: Optional[float] = Field(None, ge=1, description="Minimum seconds between health checks of a backend")
+    http_preprobe_timeout: Optional[float] = Field(None, gt=0, le=HTTP_CHECK_TIMEOUT, description="Seconds to wait for the TCP connect before an HTTP health check")
+    collect_stats: Optional[bool] = Field(None, description="Run socat with -v to collect byte counters")
 
 class RemoveServiceRequest(BaseModel):
     name: str
 
 class ToggleServerRequest(BaseModel):
     service: str
-    ip: str
+    ip: ServerIP
     port: int
 
 # ====================================================
@@ -389,19 +1104,9 @@ def socat_stats():
       - bytes_transferred: total bytes parsed from socat output (service-level)
       - bytes_out: outbound bytes (service-level)
       - bytes_in: inbound bytes (service-level)
+    The response is refreshed once per check cycle.
     """
-    stats = {}
-    for service_name, state in service_state.items():
-        stats[service_name] = {
-            "last_active": state["last_active"],
-            "restart_count": state["restart_count"],
-            "last_start_time": state["last_start_time"],
-            "pid": state["process"].pid if state["process"] and state["process"].poll() is None else None,
-            "bytes_transferred": state.get("bytes_transferred", 0),
-            "bytes_out": state.get("bytes_out", 0),
-            "bytes_in": state.get("bytes_in", 0)
-        }
-    return {"socat_stats": stats}
+    return Response(socat_stats_cache, media_type="application/json")
 
 @app.get("/api/socat_stats_by_server")
 def socat_stats_by_server():
@@ -411,19 +1116,21 @@ def socat_stats_by_server():
       - bytes_transferred: total bytes parsed from socat output
       - bytes_out: outbound bytes
       - bytes_in: inbound bytes
+    The response is refreshed once per check cycle.
     """
-    return {"socat_stats_by_server": server_stats}
+    return Response(socat_stats_by_server_cache, media_type="application/json")
 
 # ====================================================
 # FastAPI Endpoints for Load Balancer & Management
 # ====================================================
-@app.get("/", response_class=FileResponse)
+@app.get("/", response_class=Response)
 def read_index():
-    return FileResponse("public/index.html")
+    return Response(app.state.index_bytes, media_type="text/html")
 
 @app.get("/api/status")
 def api_status():
-    return {"services": server_status}
+    # Encoded once per check cycle rather than once per request.
+    return Response(status_cache, media_type="application/json")
 
 @app.get("/api/list_services")
 def list_services():
@@ -431,7 +1138,7 @@ def list_services():
 
 @app.get("/api/list_servers")
 def list_servers_endpoint(service: str):
-    service_obj = next((s for s in SERVICES if s.get("name") == service), None)
+    service_obj = services_by_name.get(service)
     if not service_obj:
         raise HTTPException(status_code=404, detail="Service not found")
     return {"servers": service_obj.get("servers", [])}
@@ -441,60 +1148,69 @@ def edit_server(req: EditServerRequest):
     service_name = req.service
     ip = req.ip
     port = req.port
-    new_ip = req.new_ip
+    new_ip = str(req.new_ip) if req.new_ip else None
     new_port = req.new_port
     check_type = req.check_type
 
-    service = next((s for s in SERVICES if s.get("name") == service_name), None)
-    if not service:
-        raise HTTPException(status_code=404, detail="Service group not found")
+    with state_lock:
+        service = services_by_name.get(service_name)
+        if not service:
+            raise HTTPException(status_code=404, detail="Service group not found")
 
-    for server in service.get("servers", []):
-        if server["ip"] == ip and int(server["port"]) == int(port):
-            if new_ip:
-                server["ip"] = new_ip
-            if new_port:
-                server["port"] = int(new_port)
-            if check_type:
-                server["check_type"] = check_type
-            save_config()
-            return {"message": f"Server {ip}:{port} edited successfully in service '{service_name}'"}
-
-    raise HTTPException(status_code=404, detail="Server not found in service group")
+        servers = servers_by_ipport[service_name]
+        server = servers.get((ip, port))
+        if not server:
+            raise HTTPException(status_code=404, detail="Server not found in service group")
+
+        new_key = (new_ip or server["ip"], new_port or server["port"])
+        if new_key != (ip, port) and new_key in servers:
+            raise HTTPException(status_code=400, detail="Server already exists in service group")
+        if new_ip:
+            server["ip"] = new_ip
+        if new_port:
+            server["port"] = new_port
+        if check_type:
+            server["check_type"] = check_type
+        del servers[(ip, port)]
+        servers[new_key] = server
+        # The cached result belongs to the old address or check type.
+        state = service_state[service_name]
+        state["checks"].pop((ip, port), None)
+        state["need_check"] = True
+        rebuild_backend_index()
+        save_config()
+    wake_event.set()
+    return {"message": f"Server {ip}:{port} edited successfully in service '{service_name}'"}
 
 @app.post("/api/add_server")
 def add_server(req: AddServerRequest):
     service_name = req.service
-    ip = req.ip
+    ip = str(req.ip)
     port = req.port
     check_type = req.check_type
 
-    service = next((s for s in SERVICES if s.get("name") == service_name), None)
-    if not service:
-        raise HTTPException(status_code=404, detail="Service group not found")
-    
-    try:
-        ipaddress.ip_address(ip)
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid IP address")
-    
-    if not (1 <= port <= 65535):
-        raise HTTPException(status_code=400, detail="Port number must be between 1 and 65535")
+    with state_lock:
+        service = services_by_name.get(service_name)
+        if not service:
+            raise HTTPException(status_code=404, detail="Service group not found")
     
-    if any(s["ip"] == ip and int(s["port"]) == int(port) for s in service.get("servers", [])):
-        raise HTTPException(status_code=400, detail="Server already exists in service group")
+        if (ip, port) in servers_by_ipport[service_name]:
+            raise HTTPException(status_code=400, detail="Server already exists in service group")
 
-    # Add "enabled": True by default.
-    new_server = {"ip": ip, "port": int(port), "check_type": check_type, "enabled": True}
-    if check_type == "http":
-        new_server["http_path"] = req.http_path
-
-    service.setdefault("servers", []).append(new_server)
-    # Initialize per-server stats for this new server.
-    server_key = f"{service_name}:{ip}:{port}"
-    if server_key not in server_stats:
-        server_stats[server_key] = {"bytes_transferred": 0, "bytes_out": 0, "bytes_in": 0}
-    save_config()
+        # Add "enabled": True by default.
+        new_server = {"ip": ip, "port": port, "check_type": check_type, "enabled": True}
+        if check_type == "http":
+            new_server["http_path"] = req.http_path
+
+        service.setdefault("servers", []).append(new_server)
+        servers_by_ipport[service_name][(ip, port)] = new_server
+        # Initialize per-server stats for this new server.
+        server_key = (service_name, ip, port)
+        if server_key not in server_stats:
+            server_stats[server_key] = {"bytes_transferred": 0, "bytes_out": 0, "bytes_in": 0}
+        rebuild_backend_index()
+        save_config()
+    wake_event.set()
     return {"message": f"Server {ip}:{port} added successfully to service '{service_name}'"}
 
 @app.post("/api/remove_server")
@@ -503,96 +1219,124 @@ def remove_server(req: RemoveServerRequest):
     ip = req.ip
     port = req.port
 
-    service = next((s for s in SERVICES if s.get("name") == service_name), None)
-    if not service:
-        raise HTTPException(status_code=404, detail="Service group not found")
+    with state_lock:
+        service = services_by_name.get(service_name)
+        if not service:
+            raise HTTPException(status_code=404, detail="Service group not found")
     
-    for server in service.get("servers", []):
-        if server["ip"] == ip and int(server["port"]) == int(port):
-            service.get("servers", []).remove(server)
-            # Remove per-server stats if they exist.
-            server_key = f"{service_name}:{ip}:{port}"
-            if server_key in server_stats:
-                del server_stats[server_key]
-            save_config()
-            return {"message": f"Server {ip}:{port} removed successfully from service '{service_name}'"}
-    
-    raise HTTPException(status_code=404, detail="Server not found in service group")
+        server = servers_by_ipport[service_name].pop((ip, port), None)
+        if not server:
+            raise HTTPException(status_code=404, detail="Server not found in service group")
+
+        service.get("servers", []).remove(server)
+        # Remove per-server stats if they exist.
+        server_key = (service_name, ip, port)
+        if server_key in server_stats:
+            del server_stats[server_key]
+        state = service_state.get(service_name)
+        if state:
+            state["checks"].pop((ip, port), None)
+        rebuild_backend_index()
+        save_config()
+    wake_event.set()
+    return {"message": f"Server {ip}:{port} removed successfully from service '{service_name}'"}
 
 @app.post("/api/set_service_mode")
 def set_service_mode(req: SetServiceModeRequest):
     service_name = req.service
     mode = req.mode
-    service = next((s for s in SERVICES if s.get("name") == service_name), None)
-    if not service:
-        raise HTTPException(status_code=404, detail="Service not found")
-    service["mode"] = mode
-    save_config()
+    with state_lock:
+        service = services_by_name.get(service_name)
+        if not service:
+            raise HTTPException(status_code=404, detail="Service not found")
+        service["mode"] = mode
+        save_config()
+    wake_event.set()
     return {"message": f"Mode for service '{service_name}' changed to {mode}"}
 
 @app.post("/api/add_service")
 def add_service(req: AddServiceRequest):
-    name = req.name
+    name = sys.intern(req.name)
     listen_port = req.listen_port
     mode = req.mode
-    if not name or not listen_port:
-        raise HTTPException(status_code=400, detail="Missing name or listen_port")
-    if any(s.get("name") == name for s in SERVICES):
-        raise HTTPException(status_code=400, detail="Service group already exists")
+    with state_lock:
+        if name in services_by_name:
+            raise HTTPException(status_code=400, detail="Service group already exists")
     
-    new_service = {"name": name, "listen_port": int(listen_port), "mode": mode, "servers": []}
-    SERVICES.append(new_service)
-    service_state[name] = {
-        "last_active": None,
-        "index": 0,
-        "process": None,
-        "restart_count": 0,
-        "last_start_time": None,
-        "bytes_transferred": 0,
-        "bytes_out": 0,
-        "bytes_in": 0
-    }
-    save_config()
+        new_service = {"name": name, "listen_port": listen_port, "mode": mode, "servers": []}
+        if req.min_check_interval is not None:
+            new_service["min_check_interval"] = req.min_check_interval
+        if req.http_preprobe_timeout is not None:
+            new_service["http_preprobe_timeout"] = req.http_preprobe_timeout
+        if req.collect_stats is not None:
+            new_service["collect_stats"] = req.collect_stats
+        SERVICES.append(new_service)
+        services_by_name[name] = new_service
+        servers_by_ipport[name] = {}
+        service_state[name] = new_service_state()
+        rebuild_backend_index()
+        save_config()
+    wake_event.set()
     return {"message": f"Service '{name}' added successfully"}
 
 @app.post("/api/edit_service")
 def edit_service(req: EditServiceRequest):
-    service = next((s for s in SERVICES if s.get("name") == req.name), None)
-    if not service:
-        raise HTTPException(status_code=404, detail="Service not found")
-    old_name = service.get("name")
-    if req.new_name:
-        if any(s.get("name") == req.new_name for s in SERVICES):
-            raise HTTPException(status_code=400, detail="A service with that new name already exists")
-        service["name"] = req.new_name
-        service_state[req.new_name] = service_state.pop(old_name)
-    if req.listen_port:
-        service["listen_port"] = req.listen_port
-        state = service_state[service.get("name")]
-        if state["process"] and state["process"].poll() is None:
-            state["process"].terminate()
-            state["process"].wait()
-            state["last_active"] = None
-    if req.mode:
-        if req.mode not in ["failover", "round-robin"]:
-            raise HTTPException(status_code=400, detail="Invalid mode")
-        service["mode"] = req.mode
-    save_config()
+    with state_lock:
+        service = services_by_name.get(req.name)
+        if not service:
+            raise HTTPException(status_code=404, detail="Service not found")
+        old_name = service.get("name")
+        if req.new_name:
+            if req.new_name in services_by_name:
+                raise HTTPException(status_code=400, detail="A service with that new name already exists")
+            new_name = sys.intern(req.new_name)
+            service["name"] = new_name
+            service_state[new_name] = service_state.pop(old_name)
+            services_by_name[new_name] = services_by_name.pop(old_name)
+            servers_by_ipport[new_name] = servers_by_ipport.pop(old_name)
+        if req.listen_port:
+            service["listen_port"] = req.listen_port
+            state = service_state[service.get("name")]
+            if state["process"] and state["process"].poll() is None:
+                state["process"].terminate()
+                state["process"].wait()
+                state["last_active"] = None
+        if req.mode:
+            service["mode"] = req.mode
+        if req.min_check_interval is not None:
+            service["min_check_interval"] = req.min_check_interval
+        if req.http_preprobe_timeout is not None:
+            service["http_preprobe_timeout"] = req.http_preprobe_timeout
+        if req.collect_stats is not None and req.collect_stats != service.get("collect_stats", True):
+            service["collect_stats"] = req.collect_stats
+            # socat picks up the new flags when the next cycle restarts it.
+            state = service_state[service.get("name")]
+            if state["process"] and state["process"].poll() is None:
+                state["process"].terminate()
+                state["process"].wait()
+        rebuild_backend_index()
+        save_config()
+    wake_event.set()
     return {"message": f"Service '{req.name}' updated successfully."}
 
 @app.post("/api/remove_service")
 def remove_service(req: RemoveServiceRequest):
-    service = next((s for s in SERVICES if s.get("name") == req.name), None)
-    if not service:
-        raise HTTPException(status_code=404, detail="Service not found")
-    state = service_state.get(req.name)
-    if state and state["process"] and state["process"].poll() is None:
-        state["process"].terminate()
-        state["process"].wait()
-    SERVICES.remove(service)
-    if req.name in service_state:
-        del service_state[req.name]
-    save_config()
+    with state_lock:
+        service = services_by_name.get(req.name)
+        if not service:
+            raise HTTPException(status_code=404, detail="Service not found")
+        state = service_state.get(req.name)
+        if state and state["process"] and state["process"].poll() is None:
+            state["process"].terminate()
+            state["process"].wait()
+        SERVICES.remove(service)
+        del services_by_name[req.name]
+        del servers_by_ipport[req.name]
+        if req.name in service_state:
+            del service_state[req.name]
+        rebuild_backend_index()
+        save_config()
+    wake_event.set()
     return {"message": f"Service '{req.name}' removed successfully."}
 
 @app.post("/api/toggle_server")
@@ -601,19 +1345,47 @@ def toggle_server(req: ToggleServerRequest):
     ip = req.ip
     port = req.port
 
-    service = next((s for s in SERVICES if s.get("name") == service_name), None)
-    if not service:
-        raise HTTPException(status_code=404, detail="Service group not found")
+    with state_lock:
+        service = services_by_name.get(service_name)
+        if not service:
+            raise HTTPException(status_code=404, detail="Service group not found")
 
-    for server in service.get("servers", []):
-        if server["ip"] == ip and int(server["port"]) == int(port):
-            # Toggle the enabled flag.
-            current_status = server.get("enabled", True)
-            server["enabled"] = not current_status
-            save_config()
-            return {"message": f"Server {ip}:{port} toggled successfully in service '{service_name}'. Now enabled: {server['enabled']}"}
-
-    raise HTTPException(status_code=404, detail="Server not found in service group")
+        server = servers_by_ipport[service_name].get((ip, port))
+        if not server:
+            raise HTTPException(status_code=404, detail="Server not found in service group")
+
+        # Toggle the enabled flag.
+        current_status = server.get("enabled", True)
+        server["enabled"] = not current_status
+        rebuild_backend_index()
+        save_config()
+    wake_event.set()
+    return {"message": f"Server {ip}:{port} toggled successfully in service '{service_name}'. Now enabled: {server['enabled']}"}
+
+@app.post("/api/reload")
+def reload_config(force: bool = False):
+    """
+    Re-reads the config file, e.g. after it was edited by hand. The file is only
+    parsed if it changed since this process last read or wrote it, unless force
+    is set. Unsaved changes made through the API are discarded, unless the file
+    is invalid, in which case the running configuration is kept as it is.
+    """
+    global config_mtime
+    if not os.path.exists(CONFIG_FILE):
+        raise HTTPException(status_code=404, detail="Config file not found")
+    try:
+        new_config = load_config(force=force)
+        if new_config is None:
+            return {"message": "Configuration unchanged"}
+        with state_lock:
+            apply_config(new_config)
+            config_dirty.clear()
+    except ValueError as e:
+        # Read the file again on the next reload, even if it is not modified.
+        config_mtime = None
+        raise HTTPException(status_code=400, detail=f"Invalid config file: {e}")
+    wake_event.set()
+    return {"message": "Configuration reloaded"}
 
 # ====================================================
 # Main entry point